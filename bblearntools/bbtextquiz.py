@@ -30,20 +30,29 @@ We create a pool of four questions, of types MC, MA, NUM and TF::
     >>> write_bbpool('TESTS/pool4.txt', [Q1, Q2, Q3, Q4]) # doctest:   +SKIP
 
 We create a pool of 16 questions of type NUM whose data are different. 
-For this, we make use of `Template strings <https://docs.python.org/3.8/library/string.html#template-strings>`_::
+For this, we make use of ``fill_question``, that fills the replacement fields 
+of a `format string <https://docs.python.org/3/library/string.html#format-string-syntax>`_.
+Note that the braces of the LaTeX code have to be doubled::
 
-    >>> from string import Template
-    >>> class BBTemplate(Template):
-    ...     delimiter = r'\temp'
-    >>> q = BBTemplate(r"How many \temp{type} pairs of distinct elements of $\{1, 2, \ldots, \temp{n}\}$ are there?")
+    >>> q = r"How many {type} pairs of distinct elements of $\{{1, 2, \ldots, {n}\}}$ are there?"
     >>> def ans(type, n): return int(n*(n-1)/2) if type == 'unordered' else n*(n-1)
-    >>> L = [fields_NUM(q.substitute(type=type, n=n), ans(type, n)) 
+    >>> L = [fields_NUM(fill_question(q, type=type, n=n), ans(type, n)) 
     ...      for n in range(7, 15) for type in ['ordered', 'unordered']]
     >>> write_bbpool('TESTS/pool_on_pairs.txt', L) # doctest:   +SKIP
     >>> len(L)
     16
     >>> L[0] # Let us a look at the first question
     ['NUM', "<script type='text/javascript' async src='https://cdn.jsdelivr.net/npm/mathjax@2/MathJax.js?config=TeX-AMS_CHTML'></script> How many ordered pairs of distinct elements of \\(\\{1,&nbsp;2,&nbsp;\\ldots,&nbsp;7\\}\\) are there?", '42', '0']
+
+If doubling the braces is not convenient, a custom delimiter can be used 
+with a regular expression, compiled once::
+
+    >>> import re
+    >>> field = re.compile(r'\\temp\{(\w+)\}')
+    >>> q = r"How many \temp{type} pairs of distinct elements of $\{1, 2, \ldots, \temp{n}\}$ are there?"
+    >>> data = {'type': 'ordered', 'n': 7}
+    >>> field.sub(lambda m: str(data[m.group(1)]), q)
+    'How many ordered pairs of distinct elements of $\\{1, 2, \\ldots, 7\\}$ are there?'
     
 Metadata
 --------
@@ -70,19 +79,34 @@ EXAMPLE:
     >>> set_decimal_separator() # back to ','as separator
     Decimal separator set to ,
 
+About the math engine (MathJax/KaTeX)
+-------------------------------------
+
+By default, the questions call MathJax2 to render their math. KaTeX renders 
+math faster; to use it instead, run ``set_math_engine('katex')``.
+
 """
 
 # imports
 #--------
-import csv
-csv.register_dialect('blackboard', delimiter='\t', quoting=csv.QUOTE_NONE)
-from itertools import chain
+import codecs
+import io
+from itertools import islice
+from functools import lru_cache
 from blackjax import blackjaxify
 
+# constants
+#----------
+_ROWS_PER_CHUNK = 1000
+# scripts calling each math engine, as in the questions
+_SCRIPTS = {engine: blackjaxify('', engine=engine).replace('\n', ' ') 
+            for engine in ['mathjax', 'katex']}
+
 # global setting
 #---------------
-options = {'decimal separator': ','}
-print("Decimal separator: ", options['decimal separator'])
+options = {'decimal separator': ',', 'math engine': 'mathjax'}
+# translation tables from decimal point to each decimal separator
+_DECIMAL_TRANSLATORS = {sep: str.maketrans('.', sep) for sep in [',', '.']}
 
 def set_decimal_separator(sep = ','):
     r"""Change the decimal separator.
@@ -110,20 +134,76 @@ def set_decimal_separator(sep = ','):
     else:
         options['decimal separator'] = sep
         print("Decimal separator set to", sep)
+
+def set_math_engine(engine='mathjax'):
+    r"""Change the engine rendering the math of the questions.
+
+    INPUT:
+
+    - ``engine`` -- string (Default: 'mathjax'). Must be either 'mathjax' 
+      (MathJax2) or 'katex' (KaTeX, which renders faster).
+ 
+    EXAMPLES:
+
+    >>> set_math_engine('katex')
+    Math engine set to katex
+    >>> fields_TF('$1 > 0$', True)[1] # doctest: +ELLIPSIS
+    "<link rel='stylesheet' href='https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/katex.min.css'>... \\(1&nbsp;>&nbsp;0\\)"
+    >>> set_math_engine()
+    Math engine set to mathjax
+"""
+    if engine not in ['mathjax', 'katex']:
+        raise ValueError('Argument of set_math_engine should be either "mathjax"\
+         or "katex", got', engine)
+    else:
+        options['math engine'] = engine
+        print("Math engine set to", engine)
+
+def _set_options(opts):
+    r"""
+    Update ``options`` with ``opts``, without checking them nor printing.
+    """
+    options.update(opts)
          
 # formatting
 #------------
 
+def fill_question(template, **kwds):
+    r"""
+    Return ``template`` with its replacement fields filled with the keyword 
+    arguments.
+    
+    This is ``template.format_map(kwds)``, which is faster than 
+    ``string.Template.substitute`` for short strings. Literal braces 
+    (as in LaTeX code) must be doubled in ``template``.
+    
+    EXAMPLE::
+    
+        >>> fill_question(r"Compute $\frac{{{a}}}{{{b}}}$.", a=1, b=2)
+        'Compute $\\frac{1}{2}$.'
+    """
+    return template.format_map(kwds)
+
 def _format_string(str, script=True):
     r"""
-    Remove newline characters and format math so that it can be rendered by Mathjax2.
+    Remove newline characters and format math so that it can be rendered by 
+    the math engine (see ``set_math_engine``).
     """
-    str = blackjaxify(str, script)
-    str = str.replace('\n', ' ')
+    str = _format_text(str)
     # Note that
-    # removing newline chars must be done AFTER blackjaxifying
-    # since blackjaxify inserts a newline char.
-    return str
+    # the script is added after removing newline chars,
+    # so that the constant script is not scanned each time.
+    return _SCRIPTS[options['math engine']] + str if script else str
+
+@lru_cache(maxsize=4096)
+def _format_text(str):
+    r"""
+    Remove newline characters and format math, without adding any script.
+    
+    Results are cached, since the same strings (answers such as 'cosine', 
+    empty sample answers, ...) are formatted many times in a pool.
+    """
+    return blackjaxify(str, script=False).replace('\n', ' ')
     
 def _fix_decimal_separator(x):
     r"""
@@ -145,12 +225,39 @@ def _fix_decimal_separator(x):
         >>> from math import sqrt
         >>> _fix_decimal_separator(sqrt(2))
         '1,4142135623730951'
+        
+    The separator is read from ``options`` at each call::
+    
+        >>> options['decimal separator'] = '.'
+        >>> _fix_decimal_separator(1.5)
+        '1.5'
+        >>> options['decimal separator'] = ','
     """
-    if options['decimal separator'] == ',':
-        return str(x).replace('.', ',')
-    else:
-        return str(x)
+    return str(x).translate(_DECIMAL_TRANSLATORS[options['decimal separator']])
     
+def _check_MC_answers(answers):
+    r"""
+    Raise an error unless exactly one of the pairs (``s``, ``b``) of 
+    ``answers`` has ``b`` True, and all others have ``b`` False.
+    """
+    trues = falses = 0
+    for (s, b) in answers:
+        trues += (b == True)
+        falses += (b == False)
+    if trues != 1:
+        raise ValueError("Exactly one of the proposed answers should be marked as True.")
+    if falses != len(answers)-1:
+        raise ValueError("All proposed answers except the correct one should be marked as False")
+
+def _answer_fields(answers):
+    r"""
+    Yield, for each pair (``s``, ``b``) of ``answers``, the formatted string 
+    ``s`` followed with 'correct' or 'incorrect' according to ``b``.
+    """
+    for (s, b) in answers:
+        yield _format_string(s, script=False)
+        yield "correct" if b else "incorrect"
+
 # types of questions
 #-------------------
     
@@ -207,11 +314,9 @@ def fields_MA(question, answers):
         ...           [('cosine', True), ('sine', False), ('$x^2$', True), ('$x+1$', False)])
         ['MA', "<script type='text/javascript' async src='https://cdn.jsdelivr.net/npm/mathjax@2/MathJax.js?config=TeX-AMS_CHTML'></script> Which of the following functions are even?", 'cosine', 'correct', 'sine', 'incorrect', '\\(x^2\\)', 'correct', '\\(x+1\\)', 'incorrect']
     """
-    question = _format_string(question)
-    answers = [(_format_string(s, script=False), b) for (s, b) in answers ]
-    return (['MA', question ] 
-            + list(chain.from_iterable([s, "correct" if b else "incorrect"]
-               for (s, b) in answers)))
+    fields = ['MA', _format_string(question)]
+    fields.extend(_answer_fields(answers))
+    return fields
 
 def fields_MC(question, answers):
     r"""Return a version of the arguments formatted as a Multiple Choice (MC) question for blackboard.
@@ -232,15 +337,10 @@ def fields_MC(question, answers):
         ...               ('a saddle point', True)])
         ['MC', "<script type='text/javascript' async src='https://cdn.jsdelivr.net/npm/mathjax@2/MathJax.js?config=TeX-AMS_CHTML'></script> For \\(F(x,y)=x^2&nbsp;y&nbsp;-&nbsp;x^2&nbsp;-&nbsp;2&nbsp;y^2&nbsp;+&nbsp;3\\), What type of point is \\((2;1)\\)?", 'a local maximum', 'incorrect', 'a local minimum', 'incorrect', 'a saddle point', 'correct']
     """
-    if [b for (s, b) in answers].count(True) != 1:
-        raise ValueError("Exactly one of the proposed answers should be marked as True.")
-    if [b for (s, b) in answers].count(False) != len(answers)-1:
-        raise ValueError("All proposed answers except the correct one should be marked as False")
-    question = _format_string(question)
-    answers = [(_format_string(s, script=False), b) for (s, b) in answers ]
-    return (['MC', question] 
-            + list(chain.from_iterable([s, "correct" if b else "incorrect"]
-               for (s, b) in answers)))
+    _check_MC_answers(answers)
+    fields = ['MC', _format_string(question)]
+    fields.extend(_answer_fields(answers))
+    return fields
                
 def fields_TF(question, ans):
     r"""Return a version of the arguments formatted as a True/False (TF) question for blackboard.
@@ -332,13 +432,168 @@ def fields_JUMBLED_SENTENCE(*args):
     
 def fields_QUIZ_BOWL(*args):
     raise NotImplementedError
+
+# building pools in parallel
+#---------------------------
+
+def build_pool(specs, workers=1, chunksize=128):
+    r"""Return the list of the questions described by ``specs``, possibly 
+    built in parallel by several processes.
+    
+    INPUT:
+    
+    - ``specs`` -- list of triples (``type``, ``args``, ``kwds``), where 
+      ``type`` is a type of question ('NUM', 'MA', 'MC', 'TF', 'ESS', 'SR' 
+      or 'FIL'), and ``args`` (a tuple) and ``kwds`` (a dictionary) are the 
+      arguments of the function ``fields_XX`` for this type.
+    
+    - ``workers`` -- integer or None (Default: 1). The number of processes. 
+      If 1, the questions are built in the current process. If None, the 
+      number of processors of the machine.
+    
+    - ``chunksize`` -- integer (Default: 128). The number of questions sent 
+      at once to a process.
+    
+    The current options (decimal separator, math engine) are used by all the 
+    processes.
+    
+    Building questions in the current process is fast (a few thousand short 
+    questions take a fraction of a second), so starting processes and 
+    sending them the questions usually costs more than it saves. Use several 
+    workers only for large pools (tens of thousands of questions, or long 
+    texts with much math) on a machine with several processors.
+    
+    EXAMPLE::
+    
+        >>> q = r"How many {type} pairs of distinct elements of $\{{1, 2, \ldots, {n}\}}$ are there?"
+        >>> specs = [('NUM', (fill_question(q, type='ordered', n=n), n*(n-1)), {}) 
+        ...          for n in range(7, 15)]
+        >>> L = build_pool(specs, workers=2)
+        >>> L == [fields_NUM(*args, **kwds) for (type, args, kwds) in specs]
+        True
+    """
+    if workers == 1:
+        return [_build_one(spec) for spec in specs]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_options,
+                             initargs=(dict(options),)) as executor:
+        return list(executor.map(_build_one, specs, chunksize=chunksize))
+
+def _build_one(spec):
+    r"""
+    Return the question described by ``spec``, a triple (``type``, ``args``, 
+    ``kwds``). See ``build_pool``.
+    """
+    (type, args, kwds) = spec
+    return _FIELDS[type](*args, **kwds)
+
+_FIELDS = {'NUM': fields_NUM, 'MA': fields_MA, 'MC': fields_MC, 'TF': fields_TF,
+           'ESS': fields_ESS, 'SR': fields_SR, 'FIL': fields_FIL}
                          
+# lines of pool files
+#--------------------
+
+def _line(*fields):
+    r"""
+    Return the line of a pool file made of ``fields``: the fields separated 
+    with tabs, ended with '\r\n' (as written by the ``csv`` module).
+    
+    EXAMPLES::
+    
+        >>> _line('TF', 'Is 1 > 0?', 'True')
+        'TF\tIs 1 > 0?\tTrue\r\n'
+        >>> _line('TF', 'Is\t1 > 0?', 'True')
+        Traceback (most recent call last):
+        ...
+        ValueError: Fields cannot contain tabs, newlines or double quotes.
+        >>> _line('TF', 'Is "1" > 0?', 'True')
+        Traceback (most recent call last):
+        ...
+        ValueError: Fields cannot contain tabs, newlines or double quotes.
+    """
+    line = '\t'.join(fields)
+    if (line.count('\t') != len(fields) - 1 
+        or '\n' in line or '\r' in line or '"' in line):
+        raise ValueError("Fields cannot contain tabs, newlines or double quotes.")
+    return line + '\r\n'
+
+def line_NUM(question, answer, tol=0):
+    r"""Return the line of a pool file for the Numerical (NUM) question
+    ``fields_NUM(question, answer, tol)``, without building the list of fields.
+    
+    EXAMPLE::
+    
+        >>> line_NUM('What is $1/2$?', 0.5)
+        "NUM\t<script type='text/javascript' async src='https://cdn.jsdelivr.net/npm/mathjax@2/MathJax.js?config=TeX-AMS_CHTML'></script> What is \\(1/2\\)?\t0,5\t0\r\n"
+    """
+    return _line('NUM', _format_string(question), 
+                 _fix_decimal_separator(answer), _fix_decimal_separator(tol))
+
+def line_MA(question, answers):
+    r"""Return the line of a pool file for the Multiple Answer (MA) question
+    ``fields_MA(question, answers)``, without building the list of fields.
+    
+    EXAMPLE::
+    
+        >>> answers = [('cosine', True), ('sine', False), ('$x^2$', True), ('$x+1$', False)]
+        >>> q = 'Which of the following functions are even?'
+        >>> line_MA(q, answers) == '\t'.join(fields_MA(q, answers)) + '\r\n'
+        True
+    """
+    return _line('MA', _format_string(question), *_answer_fields(answers))
+
+def line_MC(question, answers):
+    r"""Return the line of a pool file for the Multiple Choice (MC) question
+    ``fields_MC(question, answers)``, without building the list of fields.
+    
+    EXAMPLES::
+    
+        >>> q = r'For $F(x,y)=x^2 y - x^2 - 2 y^2 + 3$, What type of point is $(2;1)$?'
+        >>> answers = [('a local maximum', False), ('a local minimum', False), 
+        ...            ('a saddle point', True)]
+        >>> line_MC(q, answers) == '\t'.join(fields_MC(q, answers)) + '\r\n'
+        True
+        >>> line_MC(q, [('a local maximum', True), ('a saddle point', True)])
+        Traceback (most recent call last):
+        ...
+        ValueError: Exactly one of the proposed answers should be marked as True.
+    """
+    _check_MC_answers(answers)
+    return _line('MC', _format_string(question), *_answer_fields(answers))
+
+def line_TF(question, ans):
+    r"""Return the line of a pool file for the True/False (TF) question
+    ``fields_TF(question, ans)``, without building the list of fields.
+    
+    EXAMPLE::
+    
+        >>> q = 'The series with general term $1/n$ is convergent.'
+        >>> line_TF(q, False) == '\t'.join(fields_TF(q, False)) + '\r\n'
+        True
+    """
+    return _line('TF', _format_string(question), str(ans))
+
 # write in files
 #-----------------
 
-def write_bbpool(output_file, fields_list):
+def write_bbpool(output_file, fields_list, share_script=False):
     r"""Write the questions in a text file suitable for uploading in Blackboard.
     
+    INPUT:
+    
+    - ``output_file`` -- string, the path of the file.
+    
+    - ``fields_list`` -- list of questions, each of them either a list of 
+      fields (as returned by the functions ``fields_XX``) or a line (as 
+      returned by the functions ``line_XX``). Lines are written as they are, 
+      which is faster.
+    
+    - ``share_script`` -- boolean (Default: ``False``). If ``True``, the 
+      script calling the math engine is only kept in the first question, which 
+      makes the file smaller. Use it only if all questions are displayed 
+      on the same page, since the math of the other questions is not rendered 
+      otherwise.
+    
     EXAMPLE::
     
         >>> q = r'For $F(x,y)=x^2 y - x^2 - 2 y^2 + 3$, What type of point is $(2;1)$?'
@@ -348,10 +603,64 @@ def write_bbpool(output_file, fields_list):
         >>> Q2 = fields_TF('The series with general term $1/n$ is convergent.', False )
         >>> write_bbpool('TESTS/short_test.txt', [Q1, Q2]) # doctest:   +SKIP
         
+    The same file, written from lines::
+    
+        >>> Q1 = line_MC(q, [('a local maximum', False), 
+        ...                  ('a local minimum', False), 
+        ...                  ('a saddle point', True)])
+        >>> Q2 = line_TF('The series with general term $1/n$ is convergent.', False )
+        >>> write_bbpool('TESTS/short_test.txt', [Q1, Q2]) # doctest:   +SKIP
+    """
+    import csv # imported here, since only needed for writing files
+    csv.register_dialect('blackboard', delimiter='\t', quoting=csv.QUOTE_NONE)
+    encoder = codecs.getincrementalencoder('utf-16')()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, dialect='blackboard')
+    with open(output_file, "wb") as f:
+        # rows are encoded and written by chunks, not one by one
+        rows = iter(fields_list)
+        if share_script:
+            rows = _share_script(rows)
+        chunk = list(islice(rows, _ROWS_PER_CHUNK))
+        while chunk:
+            for row in chunk:
+                if isinstance(row, str):
+                    buffer.write(row)
+                else:
+                    writer.writerow(row)
+            f.write(encoder.encode(buffer.getvalue()))
+            buffer.seek(0)
+            buffer.truncate()
+            chunk = list(islice(rows, _ROWS_PER_CHUNK))
+
+def _share_script(rows):
+    r"""
+    Yield the rows of ``rows`` (lists of fields or lines), with the script 
+    calling the current math engine removed from all of them except the first.
+    
+    EXAMPLE::
+    
+        >>> rows = [fields_TF('$1 > 0$', True), line_TF('$1 < 0$', False)]
+        >>> list(_share_script(rows))[1:]
+        ['TF\t\\(1&nbsp;<&nbsp;0\\)\tFalse\r\n']
+        
+    Fields that are not strings are left as they are::
+    
+        >>> rows = [fields_TF('$1 > 0$', True), ['NUM', _SCRIPTS['mathjax'] + 'x', 1.5, 0]]
+        >>> list(_share_script(rows))[1:]
+        [['NUM', 'x', 1.5, 0]]
     """
-    with open(output_file, "w", encoding='utf-16') as f:
-        writer = csv.writer(f, dialect='blackboard')
-        writer.writerows(fields_list)
+    script = _SCRIPTS[options['math engine']]
+    rows = iter(rows)
+    for row in rows:
+        yield row
+        break
+    for row in rows:
+        if isinstance(row, str):
+            yield row.replace(script, '')
+        else:
+            yield [field.replace(script, '') if isinstance(field, str) else field 
+                   for field in row]
 
 def render_in_file(output, file):
     r"""Write all questions in an HTML file.
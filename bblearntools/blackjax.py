@@ -78,7 +78,7 @@ What *blackjaxify* does
 
 What *blackjaxify* does:
 
-* inserts a call to Mathjax2
+* inserts a call to Mathjax2 (or to KaTeX, with ``engine='katex'``)
 
 * replaces maths delimiters:
 
@@ -112,36 +112,110 @@ Mathjax tries to render it.
 # imports
 #----------
 import re
+from functools import lru_cache
 
 # constants
 #----------
 _MATHJAX_URL = 'https://cdn.jsdelivr.net/npm/mathjax@2/MathJax.js?config=TeX-AMS_CHTML'
+_SCRIPT_TEMPLATE = r"<script type='text/javascript' async src='{url}'></script>" + "\n"
+_MATHJAX_SCRIPT = _SCRIPT_TEMPLATE.format(url=_MATHJAX_URL)
+_KATEX_URL = 'https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/'
+# KaTeX reads the non-breakable spaces inserted in math mode as explicit
+# spaces, hence the ``preProcess`` option turning them back into spaces.
+# No double quotes are used, since they cannot be written in pool files.
+_KATEX_SCRIPT = (r"<link rel='stylesheet' href='{url}katex.min.css'>"
+                 r"<script defer src='{url}katex.min.js'></script>"
+                 r"<script defer src='{url}contrib/auto-render.min.js' "
+                 r"onload='renderMathInElement(document.body, {{delimiters: ["
+                 r"{{left: `\\(`, right: `\\)`, display: false}}, "
+                 r"{{left: `\\begin{{equation}}`, right: `\\end{{equation}}`, display: true}}, "
+                 r"{{left: `\\begin{{align}}`, right: `\\end{{align}}`, display: true}}], "
+                 r"preProcess: function (math) {{return math.replace(/\u00a0/g, ` `);}}}});"
+                 r"'></script>" + "\n").format(url=_KATEX_URL)
+_WHITESPACE_TO_NBSP = str.maketrans({' ': '&nbsp;', '\n': '&nbsp;'})
 _DELIMITERS = [(r'\(', r'\)'), 
                (r'\begin{equation}', r'\end{equation}'),
                (r'\begin{align}', r'\end{align}')
               ]
 
+# compiled regular expressions
+#-----------------------------
+_PRE = re.compile(r"(<pre>.*?</pre>)", re.DOTALL)
+_DOUBLE_DOLLAR = re.compile(r"\${2}(.+?)\${2}", re.DOTALL)
+_SINGLE_DOLLAR = re.compile(r"\${1}(.+?)\${1}", re.DOTALL)
+
+@lru_cache(maxsize=None)
+def _inside_pattern(opening, closing):
+    r"""
+    Return the compiled regular expression matching the substrings delimited 
+    by ``opening`` and ``closing`` (delimiters included).
+    """
+    return re.compile(r'({opening}.*?{closing})'.format(opening=re.escape(opening),
+                                                         closing=re.escape(closing)),
+                      re.DOTALL)
+
 # Main function
 #---------------------
 
-def blackjaxify(text, script=True, script_url=_MATHJAX_URL, escape_brackets=False):
+def blackjaxify(text, script=True, script_url=None, escape_brackets=False,
+                engine='mathjax'):
     r"""
     Return a formatted copy of ``text`` suitable for uploading in blackboard
     
     INPUT:
         - ``text`` -- string
         - ``script`` -- boolean (Default: ``True``)
-        - ``script_url`` -- string (Default: ``_MATHJAX_URL``)
+        - ``script_url`` -- string (Default: None, meaning ``_MATHJAX_URL``).
+          The url of MathJax2. Cannot be given with ``engine='katex'``.
         - ``escape_brackets`` -- boolean (Default:  ``False``)
+        - ``engine`` -- string (Default: ``'mathjax'``). The script inserted 
+          calls MathJax2 if ``'mathjax'``, KaTeX if ``'katex'``. KaTeX renders 
+          faster than MathJax.
+    
+    EXAMPLE::
+    
+        >>> print(blackjaxify('Solve $x^2 = 1$.', engine='katex')) # doctest: +ELLIPSIS
+        <link rel='stylesheet' href='https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/katex.min.css'>...
+        Solve \(x^2&nbsp;=&nbsp;1\).
+        >>> blackjaxify('Solve $x^2 = 1$.', script_url='MathJax.js', engine='katex')
+        Traceback (most recent call last):
+        ...
+        ValueError: script_url cannot be given with engine='katex'
     """
-    if script:
-    	text = insert_mathjax_script(text, script_url)
-    text = fix_latex_delimiters(text)
+    if engine not in ('mathjax', 'katex'):
+        raise ValueError("engine should be either 'mathjax' or 'katex', got", engine)
+    if engine == 'katex' and script_url is not None:
+        raise ValueError("script_url cannot be given with engine='katex'")
+    # texts without any math delimiter need no regex processing
+    has_math = _has_math(text)
+    if has_math:
+        text = fix_latex_delimiters(text)
     if escape_brackets:
         text = escape_opening_brackets(text) 
-    text = remove_spaces_in_latex(text) 
+    if has_math:
+        text = remove_spaces_in_latex(text) 
+    # the script is inserted last, so that it is not processed as the text
+    if script:
+        if engine == 'katex':
+            text = insert_katex_script(text)
+        else:
+            text = insert_mathjax_script(text, script_url or _MATHJAX_URL)
     return text
 
+def _has_math(text):
+    r"""
+    Return whether ``text`` contains a dollar or an opening math delimiter 
+    (``\(`` or ``\begin{``).
+    
+    EXAMPLES::
+    
+        >>> _has_math('Give three facts about it.')
+        False
+        >>> _has_math(r'Solve \(x^2 = 1\).')
+        True
+    """
+    return '$' in text or r'\(' in text or r'\begin{' in text
+
 def insert_mathjax_script(text, url=_MATHJAX_URL):
     """
     Return a copy of ``text`` with a script calling MathJax2 added at the 
@@ -150,9 +224,20 @@ def insert_mathjax_script(text, url=_MATHJAX_URL):
     The default url does the job, but another url may be used, for instance 
     the url of a local script.
     """
-    mathjax = (r"<script type='text/javascript' async src='{url}'></script>" 
-               + "\n").format(url=url)
-    return mathjax + text
+    if url == _MATHJAX_URL:
+        return _MATHJAX_SCRIPT + text
+    return _SCRIPT_TEMPLATE.format(url=url) + text
+
+def insert_katex_script(text):
+    r"""
+    Return a copy of ``text`` with the scripts calling KaTeX and its 
+    auto-render extension added at the beginning.
+    
+    The math delimiters rendered are those produced by ``blackjaxify``: 
+    ``\(`` ... ``\)``, ``\begin{equation}`` ... ``\end{equation}`` and 
+    ``\begin{align}`` ... ``\end{align}``.
+    """
+    return _KATEX_SCRIPT + text
 
 def escape_opening_brackets(text):
     r"""
@@ -164,8 +249,23 @@ def escape_opening_brackets(text):
     This is not the case for closing brackets.
     
     Needed for some types of questions such as FIB_PLUS.
+    
+    EXAMPLES::
+    
+        >>> escape_opening_brackets('x in [0;1]')
+        'x in \\[0;1]'
+        >>> escape_opening_brackets('[a] <pre>L[0]</pre> [b]')
+        '\\[a] <pre>L[0]</pre> \\[b]'
     """
-    return text.replace('[', r'\[')
+    if '[' not in text:
+        return text
+    if '<pre>' not in text:
+        return text.replace('[', r'\[')
+    # the <pre></pre> blocks are at the odd positions in ``parts``
+    parts = _PRE.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].replace('[', r'\[')
+    return ''.join(parts)
 
 def replace_inside(s, opening, closing, before=" ", after="&nbsp;"):
     r"""
@@ -183,13 +283,10 @@ def replace_inside(s, opening, closing, before=" ", after="&nbsp;"):
         >>> replace_inside(s, '$', '$', '**', '^')
         '**Note that:** $ 2^2 = 4$.'
     """
-    opening = re.escape(opening)
-    closing = re.escape(closing)
-    inside = re.compile((r'({opening}.*?{closing})'
-                         .format(opening=opening,closing=closing)),
-                        re.DOTALL)
-    return re.sub(inside, lambda x: x.group(1).replace(before, after), s)
+    inside = _inside_pattern(opening, closing)
+    return inside.sub(lambda x: x.group(1).replace(before, after), s)
 
+@lru_cache(maxsize=2048)
 def fix_latex_delimiters(text):
     r"""
     Return the string obtained by replacing the LaTeX delimiters 
@@ -208,6 +305,11 @@ def fix_latex_delimiters(text):
         >>> fix_latex_delimiters("$$1+1=2$$")
         '\\begin{equation}1+1=2\\end{equation}'
         
+    An unmatched dollar is left as it is::
+    
+        >>> fix_latex_delimiters("cost $5 and $$x$$")
+        'cost $5 and \\begin{equation}x\\end{equation}'
+        
     In the following example, the current code would return erroneously 
     ``'Price: 2\\\\(. But \\)2+2=4$.'``. 
     A ``NotImplemented Error`` is returned instead::
@@ -224,13 +326,15 @@ def fix_latex_delimiters(text):
        This is (for pair of matching simple dollars):
        ``re.sub(r'(^|[^\$])\$([^\$]+)\$([^\$]|$)',r'\1\\(\2\\)\3', text)``
     """
-    if re.search(r"\\\$", text) != None:
+    if '\\$' in text:
         raise NotImplementedError("The string contains escaped dollars.")
-    text = re.sub(r"\${2}(.+?)\${2}", r"\\begin{equation}\1\\end{equation}" ,
-                  text, flags = re.DOTALL) 
-    text = re.sub(r"\${1}(.+?)\${1}", r"\(\1\)" , text, flags = re.DOTALL)
+    # double dollars must be replaced first, in a separate pass, so that an
+    # unmatched simple dollar does not capture display math
+    text = _DOUBLE_DOLLAR.sub(r"\\begin{equation}\1\\end{equation}", text)
+    text = _SINGLE_DOLLAR.sub(r"\(\1\)", text)
     return text
 
+@lru_cache(maxsize=2048)
 def remove_spaces_in_latex(text):
     r"""
     Return a copy of the text with all spaces and newline characters
@@ -259,6 +363,9 @@ def remove_spaces_in_latex(text):
         
     """
     for (opening, closing) in _DELIMITERS:
-        text = replace_inside(text, opening, closing, ' ', '&nbsp;')
-        text = replace_inside(text, opening, closing, '\n', '&nbsp;')
+        # the math substrings are at the odd positions in ``parts``
+        parts = _inside_pattern(opening, closing).split(text)
+        for i in range(1, len(parts), 2):
+            parts[i] = parts[i].translate(_WHITESPACE_TO_NBSP)
+        text = ''.join(parts)
     return text